@@ -13,10 +13,13 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     url='https://github.com/emorynlp/StreamSide',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(include=['streamside', 'streamside.*']),
     install_requires=[
-         'PyQt5==5.15.4'
+         'PyQt5>=5.15,<6'
      ],
+    extras_require={
+         'fast': ['orjson']
+     },
      classifiers=[
          'Programming Language :: Python :: 3',
          'License :: OSI Approved :: Apache Software License',
@@ -17,39 +17,43 @@ __author__ = 'Jinho D. Choi'
 import sys
 from datetime import datetime
 
-try:
-    import importlib.resources as pkg_resources
-except ImportError:
-    import importlib_resources as pkg_resources
-
 from streamside.resources import wiser, amr
 
 import argparse
-import json
+import hashlib
+import html
+import marshal
 import os
 import re
 from typing import List, Dict, Optional, Tuple, Callable, Set, Union
 
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QKeySequence, QTextCursor, QTextCharFormat, QFont
+from PyQt5.QtCore import Qt, QStringListModel, QRunnable, QThreadPool, QTimer, QObject, QEvent, pyqtSignal
+from PyQt5.QtGui import QKeySequence, QTextCursor, QTextCharFormat, QFont, QColor
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QMainWindow, QAction, qApp, QFileDialog, QHBoxLayout, \
-    QMessageBox, QGridLayout, QTextEdit, QCompleter, QLineEdit, QDialog, QPushButton, QCheckBox, QPlainTextEdit, QShortcut, QStatusBar, QInputDialog, QVBoxLayout
+    QMessageBox, QGridLayout, QCompleter, QLineEdit, QDialog, QPushButton, QCheckBox, QPlainTextEdit, QShortcut, QStatusBar, QInputDialog, QVBoxLayout
 
-from streamside.struct import Graph, OffsetMap, Offset, penman_reader
+from streamside.struct import Graph, OffsetMap, Offset, penman_reader, json_loads
 
 
 class InputDialog(QDialog):
-    def __init__(self, parent, title: str, width: int, completer_list: List[str], completer_max: int):
+    def __init__(self, parent, title: str, width: int, completer_model: QStringListModel, completer_max: int):
         super().__init__(parent)
         self.setWindowTitle(title)
         self.setMinimumWidth(width)
 
-        # completer
-        completer = QCompleter(completer_list)
+        # completer: the model is shared across dialogs and sorted in advance
+        completer = QCompleter(self)
+        completer.setModel(completer_model)
+        completer.setModelSorting(QCompleter.CaseSensitivelySortedModel)
+        completer.setCompletionMode(QCompleter.PopupCompletion)
+        completer.setFilterMode(Qt.MatchStartsWith)
         completer.setMaxVisibleItems(completer_max)
+        completer.popup().setUniformItemSizes(True)
         self.ledit = QLineEdit()
         self.ledit.setCompleter(completer)
         self.ledit.editingFinished.connect(self.edit_finished)
+        self.lb_desc = QPlainTextEdit()
+        self.lb_desc.setReadOnly(True)
 
         self.ok = False
         self.btn_ok = QPushButton("OK", self)
@@ -60,6 +64,11 @@ class InputDialog(QDialog):
     def edit_finished(self):
         pass
 
+    def set_description(self, text: str):
+        # editingFinished also fires on focus changes, so skip the relayout when nothing changed
+        if text != self.lb_desc.toPlainText():
+            self.lb_desc.setPlainText(text)
+
     def button_ok(self):
         self.ok = self.sender() == self.btn_ok
         self.close()
@@ -70,50 +79,50 @@ class InputDialog(QDialog):
 
 class ConceptDialog(InputDialog):
     def __init__(self, parent, title: str, concept_name: str, attribute: bool):
-        ctype = 'an attribute' if attribute else 'a concept'
-        super().__init__(parent, '{} {}'.format(title, ctype), 350, parent.concept_list, 50)
+        super().__init__(parent, title, 350, parent.concept_model, 50)
         self.concept_dict = parent.concept_dict
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        # components
-        self.ledit.setText(concept_name)
-        self.lb_desc = QPlainTextEdit('Description')
-        self.lb_desc.setReadOnly(True)
-
-        wg_concept = QWidget()
-        l = QHBoxLayout()
-        l.setContentsMargins(0, 0, 0, 0)
-        wg_concept.setLayout(l)
-        l.addWidget(self.ledit)
-
         # self.ck_attr = QCheckBox()
         # l.addWidget(self.ck_attr)
         # l.addWidget(QLabel('Attribute'))
 
         # buttons
-        wg_button = QWidget()
         l = QHBoxLayout()
         l.setContentsMargins(50, 0, 50, 0)
-        wg_button.setLayout(l)
         l.addWidget(self.btn_ok)
         l.addWidget(self.btn_cancel)
 
         # layout
         layout.addWidget(QLabel('Enter the name:'))
-        layout.addWidget(wg_concept)
+        layout.addWidget(self.ledit)
         layout.addWidget(self.lb_desc)
-        layout.addWidget(wg_button)
+        layout.addLayout(l)
 
         # shortcut
         self.sct_attribute = QShortcut(QKeySequence('Ctrl+R'), self)
         self.sct_attribute.activated.connect(self.check_attribute)
+        self.reset(title, concept_name, attribute)
+
+    def reset(self, title: str, concept_name: str, attribute: bool):
+        """
+        Prepares this dialog for the next input so the same instance can be reused.
+        :param title: the title of this dialog without the concept type.
+        :param concept_name: the initial name of the concept.
+        :param attribute: if True, the concept is an attribute.
+        """
+        ctype = 'an attribute' if attribute else 'a concept'
+        self.setWindowTitle('{} {}'.format(title, ctype))
+        self.ok = False
+        self.ledit.setText(concept_name)
+        self.ledit.setFocus()
+        self.set_description('Description')
 
     def edit_finished(self):
         v = self.concept_dict.get(self.ledit.text().strip(), None)
         text = v['description'] if v else 'No description available'
-        self.lb_desc.setPlainText(text)
-        self.lb_desc.repaint()
+        self.set_description(text)
 
     def check_attribute(self):
         self.ck_attr.setChecked(not self.ck_attr.isChecked())
@@ -126,83 +135,94 @@ class ConceptDialog(InputDialog):
 
 class RelationDialog(InputDialog):
     def __init__(self, parent, title: str, parent_id: str, child_id: str, label: str = '', update: bool = False):
-        super().__init__(parent, title, 550, parent.relation_list, 50)
+        super().__init__(parent, title, 550, parent.relation_model, 50)
+        self.mode = parent.mode
+        self.concept_dict = parent.concept_dict
         self.relation_dict = parent.relation_dict
-        layout = QVBoxLayout()
+        layout = QGridLayout()
+        layout.setColumnStretch(0, 1)
         self.setLayout(layout)
 
-        graph = parent.current_graph
-        parent_concept = graph.get_concept(parent_id)
-        child_concept = graph.get_concept(child_id)
-        parent_desc = '({} / {})'.format(parent_id, parent_concept.name)
-        child_desc = '({} / {})'.format(child_id, child_concept.name)
-
         # components
-        self.ledit.setText(label)
+        self.lb_parent = QLabel()
+        self.lb_child = QLabel()
         self.referent = QCheckBox()
+        self.lb_referent = QLabel('Referent')
         self.inverse = QCheckBox()
-        self.lb_desc = QPlainTextEdit('Description')
-        self.lb_desc.setReadOnly(True)
-
-        # AMR only
+        self.lb_inverse = QLabel('-of')
         self.concept_desc = None
-        if parent.mode == 'amr':
-            con = parent.current_graph.get_concept(parent_id)
-            d = parent.concept_dict.get(con.name, None)
-            if d and d['type'] == 'pred':
-                self.concept_desc = d['description']
-                self.lb_desc.setPlainText(self.concept_desc)
+
+        # parent
+        layout.addWidget(self.lb_parent, 0, 0, 1, 3)
 
         # child + referent
-        wg_child = QWidget()
-        l = QHBoxLayout()
-        l.setContentsMargins(0, 0, 0, 0)
-        wg_child.setLayout(l)
-        l.addWidget(QLabel('Child: {}'.format(child_desc)), 80)
-        if not update:
-            if graph.parent_relations(child_id) or graph.is_ancestor(child_id, parent_id):
-                self.referent.setChecked(True)
-                self.referent.setEnabled(False)
-            l.addWidget(self.referent)
-            l.addWidget(QLabel('Referent'))
+        layout.addWidget(self.lb_child, 1, 0)
+        layout.addWidget(self.referent, 1, 1)
+        layout.addWidget(self.lb_referent, 1, 2)
 
         # ledit + inverse
-        wg_ledit = QWidget()
-        l = QHBoxLayout()
-        l.setContentsMargins(0, 0, 0, 0)
-        wg_ledit.setLayout(l)
-        l.addWidget(self.ledit)
-        if not update:
-            l.addWidget(self.inverse)
-            l.addWidget(QLabel('-of'))
+        layout.addWidget(self.ledit, 2, 0)
+        layout.addWidget(self.inverse, 2, 1)
+        layout.addWidget(self.lb_inverse, 2, 2)
+
+        # description
+        layout.addWidget(self.lb_desc, 3, 0, 1, 3)
 
         # buttons
-        wg_button = QWidget()
         l = QHBoxLayout()
         l.setContentsMargins(50, 0, 50, 0)
-        wg_button.setLayout(l)
         l.addWidget(self.btn_ok)
         l.addWidget(self.btn_cancel)
-
-        # layout
-        layout.addWidget(QLabel('Parent: {}'.format(parent_desc)))
-        layout.addWidget(wg_child)
-        layout.addWidget(wg_ledit)
-        layout.addWidget(self.lb_desc)
-        layout.addWidget(wg_button)
+        layout.addLayout(l, 4, 0, 1, 3)
 
         # shortcuts
         self.sct_referent = QShortcut(QKeySequence('Ctrl+R'), self)
         self.sct_referent.activated.connect(self.check_referent)
         self.sct_inverse = QShortcut(QKeySequence('Ctrl+F'), self)
         self.sct_inverse.activated.connect(self.check_inverse)
+        self.reset(title, parent.current_graph, parent_id, child_id, label, update)
+
+    def reset(self, title: str, graph: Graph, parent_id: str, child_id: str, label: str = '', update: bool = False):
+        """
+        Prepares this dialog for the next input so the same instance can be reused.
+        :param title: the title of this dialog.
+        :param graph: the graph containing the parent and child concepts.
+        :param parent_id: the ID of the parent concept.
+        :param child_id: the ID of the child concept.
+        :param label: the initial label of the relation.
+        :param update: if True, the referent and inverse options are hidden.
+        """
+        parent_concept = graph.get_concept(parent_id)
+        child_concept = graph.get_concept(child_id)
+        self.setWindowTitle(title)
+        self.ok = False
+        self.lb_parent.setText('Parent: ({} / {})'.format(parent_id, parent_concept.name))
+        self.lb_child.setText('Child: ({} / {})'.format(child_id, child_concept.name))
+        self.ledit.setText(label)
+        self.ledit.setFocus()
+        self.set_description('Description')
+
+        # referent + inverse
+        fixed = not update and bool(graph.parent_relations(child_id) or graph.is_ancestor(child_id, parent_id))
+        self.referent.setChecked(fixed)
+        self.referent.setEnabled(not fixed)
+        self.inverse.setChecked(False)
+        for w in (self.referent, self.lb_referent, self.inverse, self.lb_inverse):
+            w.setVisible(not update)
+
+        # AMR only
+        self.concept_desc = None
+        if self.mode == 'amr':
+            d = self.concept_dict.get(parent_concept.name, None)
+            if d and d['type'] == 'pred':
+                self.concept_desc = d['description']
+                self.set_description(self.concept_desc)
 
     def edit_finished(self):
         if self.concept_desc is None:
             v = self.relation_dict.get(self.ledit.text().strip(), None)
             text = v['description'] if v else 'No description available'
-            self.lb_desc.setPlainText(text)
-            self.lb_desc.repaint()
+            self.set_description(text)
 
     def check_referent(self):
         self.referent.setChecked(not self.referent.isChecked())
@@ -221,6 +241,44 @@ class RelationDialog(InputDialog):
             return None
 
 
+class SaveSignals(QObject):
+    # emitted on the save thread; connections to objects on the GUI thread are queued
+    failed = pyqtSignal(str, str)
+
+
+class SaveTask(QRunnable):
+    def __init__(self, filename: str, graphs: List[str], signals: SaveSignals):
+        """
+        Writes the graphs to a temporary file and moves it over the output file so a partial save never replaces it.
+        :param filename: the path to the output file.
+        :param graphs: the serialized graphs, each indented for the output file.
+        :param signals: emits (filename, error) when the save fails.
+        """
+        super().__init__()
+        self.filename = filename
+        self.graphs = graphs
+        self.signals = signals
+
+    def run(self):
+        tmp_file = self.filename + '.tmp'
+        try:
+            # graphs are streamed one by one instead of joining the whole document in memory
+            # json_dumps emits raw UTF-8, so the locale encoding cannot be used
+            with open(tmp_file, 'w', encoding='utf-8') as fout:
+                fout.write('{\n  "graphs": [\n')
+                for i, graph in enumerate(self.graphs):
+                    if i > 0: fout.write(',\n')
+                    fout.write(graph)
+                fout.write('\n  ]\n}\n')
+            os.replace(tmp_file, self.filename)
+        except Exception as e:
+            try:
+                if os.path.exists(tmp_file): os.remove(tmp_file)
+            except OSError:
+                pass
+            self.signals.failed.emit(self.filename, str(e))
+
+
 class GraphAnnotator(QMainWindow):
     def __init__(self, resource_dir: str, mode: str, annotator: str = 'unknown'):
         super().__init__()
@@ -238,31 +296,61 @@ class GraphAnnotator(QMainWindow):
         self.COLOR_SELECTED_CHILD = 'lightgreen'
         self.COLOR_COVERED_TEXT_SPAN = 'khaki'
         self.COLOR_SELECTED_CONCEPT = 'burlywood'
+        self.FORMAT_SELECTED_PARENT = background_format(self.COLOR_SELECTED_PARENT)
+        self.FORMAT_SELECTED_CHILD = background_format(self.COLOR_SELECTED_CHILD)
+        self.FORMAT_SELECTED_CONCEPT = background_format(self.COLOR_SELECTED_CONCEPT)
+        self.SPAN_COVERED_TOKEN = background_span(self.COLOR_COVERED_TOKEN)
+        self.SPAN_SELECTED_PARENT = background_span(self.COLOR_SELECTED_PARENT)
+        self.SPAN_SELECTED_CHILD = background_span(self.COLOR_SELECTED_CHILD)
+        self.SPAN_COVERED_TEXT_SPAN = background_span(self.COLOR_COVERED_TEXT_SPAN)
+        self.SPAN_SELECTED_CONCEPT = background_span(self.COLOR_SELECTED_CONCEPT)
 
         # resources
         self.concept_dict: Dict[str, str] = dict()
         self.concept_list: List[str] = []
         self.relation_dict: Dict[str, str] = dict()
         self.relation_list: List[str] = []
+        self.concept_model = QStringListModel(self)
+        self.relation_model = QStringListModel(self)
         self.init_resources(resource_dir, mode)
 
         # fields
         self.mode = mode
         self.annotator: str = annotator
         self.filename: str = ''
+        self.dirty: bool = False
+        self.concept_dialog: Optional[ConceptDialog] = None
+        self.relation_dialog: Optional[RelationDialog] = None
         self.tid: int = -1
-        self.graphs: List[Graph] = []
-        self.offset_maps: List[OffsetMap] = []
+        self.graphs: List[Optional[Graph]] = []
+        self.offset_maps: List[Optional[OffsetMap]] = []
+        self.graph_jsons: List[Optional[str]] = []
+        self.texts: List[str] = []
+        self.text_id: str = ''
         self.selected_parent: Optional[Tuple[str, int]] = None
         self.selected_child: Optional[Tuple[str, int]] = None
         self.selected_concept: Optional[Tuple[str, int]] = None
         self.selected_text_spans: Set[int] = set()
+        self.graph_texts: List[str] = []
+        self.graph_highlights: List[Tuple[int, int]] = []
+
+        # rapid navigation is coalesced into one refresh of the last selected annotation
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(10)
+        self.refresh_timer.timeout.connect(self._refresh_selected_annotation)
+
+        # a single thread keeps the saves in order
+        self.save_pool = QThreadPool(self)
+        self.save_pool.setMaxThreadCount(1)
+        self.save_signals = SaveSignals(self)
+        self.save_signals.failed.connect(self._save_failed)
 
         # graphical user interface
-        layout = self._init_central_widget('StreamSide Graph Annotator: {}'.format(annotator), 800, 800)
+        layout = self._init_central_widget(f'StreamSide Graph Annotator: {annotator}', 800, 800)
         self.lb_tid = QLabel('Index:')
         self.lb_text = QLabel('Open a text or json file to start annotating')
-        self.te_graph = QTextEdit()
+        self.te_graph = QPlainTextEdit()
         self.statusbar = self._init_statusbar()
         self._init_annotation(layout)
         self._init_menubar()
@@ -271,29 +359,45 @@ class GraphAnnotator(QMainWindow):
 
     @property
     def current_graph(self) -> Optional[Graph]:
-        return self.graphs[self.tid] if 0 <= self.tid < len(self.graphs) else None
+        return self.get_graph(self.tid) if 0 <= self.tid < len(self.graphs) else None
 
     @property
     def current_offset_map(self) -> Optional[OffsetMap]:
-        return self.offset_maps[self.tid] if 0 <= self.tid < len(self.offset_maps) else None
+        if not 0 <= self.tid < len(self.offset_maps): return None
+        if self.offset_maps[self.tid] is None:
+            self.offset_maps[self.tid] = OffsetMap(self.get_graph(self.tid).tokens)
+        return self.offset_maps[self.tid]
+
+    def get_graph(self, tid: int) -> Graph:
+        """
+        Graphs of a text file are created when they are accessed for the first time.
+        :param tid: the index of the graph.
+        :return: the graph at the index.
+        """
+        graph = self.graphs[tid]
+        if graph is None:
+            graph = self.graphs[tid] = self._create_graph(tid)
+        return graph
+
+    def _create_graph(self, tid: int) -> Graph:
+        return Graph(self.texts[tid], f'{self.text_id}.{tid}', self.annotator)
 
     ########################################  Init  ########################################
 
     def init_resources(self, resource_dir: str, mode: str):
-        if resource_dir:
-            f_concepts = open(os.path.join(resource_dir, 'concepts.json'))
-            f_relations = open(os.path.join(resource_dir, 'relations.json'))
-        else:
-            m = wiser if mode == 'wiser' else amr
-            f_concepts = pkg_resources.open_text(m, 'concepts.json')
-            f_relations = pkg_resources.open_text(m, 'relations.json')
+        if not resource_dir:
+            resource_dir = os.path.dirname((wiser if mode == 'wiser' else amr).__file__)
 
-        # concepts
-        self.concept_dict = json.load(f_concepts)
+        # resources
+        self.concept_dict = load_json(os.path.join(resource_dir, 'concepts.json'))
         self.concept_list = sorted(self.concept_dict.keys())
-        self.relation_dict = json.load(f_relations)
+        self.relation_dict = load_json(os.path.join(resource_dir, 'relations.json'))
         self.relation_list = sorted(self.relation_dict.keys())
 
+        # completer models shared by all dialogs
+        self.concept_model.setStringList(self.concept_list)
+        self.relation_model.setStringList(self.relation_list)
+
     def _init_central_widget(self, title: str, width: int, height: int) -> QGridLayout:
         widget = QWidget()
         layout = QGridLayout()
@@ -304,7 +408,8 @@ class GraphAnnotator(QMainWindow):
         return layout
 
     def _init_annotation(self, layout: QGridLayout):
-        # text
+        # text; always rich text so Qt does not have to guess the format on every refresh
+        self.lb_text.setTextFormat(Qt.RichText)
         self.lb_text.setTextInteractionFlags(Qt.TextSelectableByMouse)
         self.lb_text.setWordWrap(True)
 
@@ -319,6 +424,8 @@ class GraphAnnotator(QMainWindow):
 
         # graph
         self.te_graph.setReadOnly(True)
+        self.te_graph.setFont(self.FONT_GRAPH)
+        self.te_graph.setUndoRedoEnabled(False)
         layout.addWidget(self.te_graph)
 
     def _init_statusbar(self) -> QStatusBar:
@@ -381,7 +488,7 @@ class GraphAnnotator(QMainWindow):
 
     def menu_file_open(self):
         def open_txt(txt_file):
-            json_file = '{}{}.json'.format(txt_file[:-3], self.annotator)
+            json_file = f'{txt_file[:-3]}{self.annotator}.json'
             self.filename = json_file
 
             if os.path.exists(json_file):
@@ -389,18 +496,21 @@ class GraphAnnotator(QMainWindow):
                 message_box(msg, QMessageBox.Ok)
                 open_json(json_file)
             else:
-                fin = open(txt_file)
-                tid = os.path.basename(txt_file)[:-4]
-                self.graphs = [Graph(text, '{}.{}'.format(tid, i), self.annotator) for i, text in enumerate(fin)]
+                # split on newlines only as str.splitlines also breaks on form feeds, U+2028, etc.
+                with open(txt_file, encoding='utf-8') as fin:
+                    self.texts = fin.read().split('\n')
+                if self.texts[-1] == '': self.texts.pop()
+                self.text_id = os.path.basename(txt_file)[:-4]
+                self.graphs = [None] * len(self.texts)
 
         def open_json(json_file):
             self.filename = json_file
-            with open(self.filename) as fin:
-                d = json.load(fin)
-                self.graphs = [Graph.factory(graph) for graph in d['graphs']]
+            with open(self.filename, 'rb') as fin:
+                d = json_loads(fin.read())
+            self.graphs = [Graph.factory(graph) for graph in d['graphs']]
 
         def open_penman(penman_file):
-            json_file = '{}{}.json'.format(penman_file[:-6], self.annotator)
+            json_file = f'{penman_file[:-6]}{self.annotator}.json'
             self.filename = json_file
 
             if os.path.exists(json_file):
@@ -413,22 +523,21 @@ class GraphAnnotator(QMainWindow):
         # get filename
         filename = QFileDialog.getOpenFileName(self, 'Open File')[0]
         if not filename: return
-        self.menu_file_save()
+        if self.dirty: self.menu_file_save()
+        self.save_pool.waitForDone()
 
         # check extension
-        if filename[-4:].lower() == '.txt':
-            open_txt(filename)
-        elif filename[-5:].lower() == '.json':
-            open_json(filename)
-        elif filename[-7:].lower() == '.penman':
-            open_penman(filename)
-        else:
+        ext = os.path.splitext(filename)[1].lower()
+        open_func = {'.txt': open_txt, '.json': open_json, '.penman': open_penman}.get(ext, None)
+        if open_func is None:
             self.statusbar.showMessage('Unsupported file type: {}'.format(os.path.basename(filename)))
             return
+        open_func(filename)
 
         # initialize
         self.statusbar.showMessage('Open: {}'.format(self.filename))
-        self.offset_maps = [OffsetMap(graph.tokens) for i, graph in enumerate(self.graphs)]
+        self.offset_maps = [None] * len(self.graphs)
+        self.graph_jsons = [None] * len(self.graphs)
         self.setWindowTitle(os.path.basename(self.filename))
         self.select_annotation(0)
 
@@ -437,11 +546,16 @@ class GraphAnnotator(QMainWindow):
             self.statusbar.showMessage('Output file is not specified.')
             return
 
+        # serialize on the GUI thread so the snapshot is consistent; write on the save thread
         self.current_graph.last_saved = current_time()
-        with open(self.filename, 'w') as fout:
-            d = ['    ' + graph.json_dumps() for graph in self.graphs]
-            fout.write('{{\n  "graphs": [\n{}\n  ]\n}}\n'.format(',\n'.join(d)))
-
+        self.graph_jsons[self.tid] = None
+        d = self.graph_jsons
+
+        # graphs are only edited while selected and every save covers the selected one, so the rest are reused
+        for i, s in enumerate(d):
+            if s is None: d[i] = '    ' + (self.graphs[i] or self._create_graph(i)).json_dumps()
+        self.dirty = False
+        self.save_pool.start(SaveTask(self.filename, list(d), self.save_signals))  # copied as the cache keeps changing
         self.statusbar.showMessage('Save: {}'.format(self.filename))
 
     def menu_file_about(self):
@@ -452,8 +566,17 @@ class GraphAnnotator(QMainWindow):
         msg.setStandardButtons(QMessageBox.Ok)
         msg.exec_()
 
+    def _save_failed(self, filename: str, error: str):
+        # the annotation may have been switched to another file while the save was pending
+        if filename == self.filename: self.dirty = True
+        self.statusbar.showMessage('Failed to save: {}'.format(filename))
+        message_box('Failed to save {}\n{}'.format(filename, error), QMessageBox.Ok)
+
     def closeEvent(self, event):
         self.menu_file_save()
+        self.save_pool.waitForDone()
+        # deliver a pending failure report before the window goes away (the slot is reached through a proxy, not self)
+        QApplication.sendPostedEvents(None, QEvent.MetaCall)
         event.accept()
 
     ####################  Menubar: Edit  ####################
@@ -463,11 +586,12 @@ class GraphAnnotator(QMainWindow):
         graph = self.current_graph
         tokens = graph.get_tokens(self.selected_text_spans)
         text = ' '.join(tokens) if attribute else '-'.join(tokens).lower()
-        name = ConceptDialog(self, 'Create', text, attribute).exec_()
+        name = self._concept_dialog('Create', text, attribute).exec_()
         ctype = 'Attribute' if attribute else 'Concept'
 
         if name:
             cid = graph.add_concept(name, self.selected_text_spans, attribute)
+            self.dirty = True
             self.selected_text_spans.clear()
             self.refresh_annotation()
             self.statusbar.showMessage('{} created: ({} / {}) - {}'.format(ctype, cid, name, str(tokens)))
@@ -492,11 +616,12 @@ class GraphAnnotator(QMainWindow):
         graph = self.current_graph
         parent_id = self.selected_parent[0]
         child_id = self.selected_child[0]
-        t = RelationDialog(self, 'Create a relation', parent_id, child_id).exec_()
+        t = self._relation_dialog('Create a relation', parent_id, child_id).exec_()
         if t:
             label = t[0]
             referent = t[1]
             graph.add_relation(parent_id, child_id, label, referent)
+            self.dirty = True
             self.selected_parent = self.selected_parent[0], None
             self.selected_child = None
             self.refresh_annotation()
@@ -527,6 +652,7 @@ class GraphAnnotator(QMainWindow):
                     break
 
         if deleted:
+            self.dirty = True
             self.selected_parent = None
             self.selected_child = None
             self.selected_concept = None
@@ -546,23 +672,24 @@ class GraphAnnotator(QMainWindow):
         if type(sel) is str:
             c = graph.get_concept(sel)
             if c:
-                name = ConceptDialog(self, 'Update', c.name, c.attribute).exec_()
+                name = self._concept_dialog('Update', c.name, c.attribute).exec_()
                 if name:
-                    c.name = name
+                    graph.update_concept(sel, name)
                     updated = True
                     self.statusbar.showMessage('Update: {}'.format(sel))
         else:
             label, parent_id, child_id = sel[0], sel[1], sel[2]
             for rid, r in graph.parent_relations(child_id):
                 if r.label == label and r.parent_id == parent_id:
-                    name = RelationDialog(self, 'Update the relation', parent_id, child_id, label, True).exec_()
+                    name = self._relation_dialog('Update the relation', parent_id, child_id, label, True).exec_()
                     if name:
-                        r.label = name[0]
+                        graph.update_relation(rid, name[0])
                         self.statusbar.showMessage('Update relation: {}({}, {})'.format(label, parent_id, child_id))
                         updated = True
                     break
 
         if updated:
+            self.dirty = True
             self.selected_parent = None
             self.selected_child = None
             self.selected_concept = None
@@ -571,13 +698,14 @@ class GraphAnnotator(QMainWindow):
             self.statusbar.showMessage('No valid concept or relation is highlighted.')
 
     def find_concept_or_relation(self) -> Optional[Union[str, Tuple[str, str, str]]]:
+        self.flush_refresh()
         cursor = self.te_graph.textCursor()
         sel = cursor.selectedText()
         if not sel:
             self.statusbar.showMessage('No concept or relation is highlighted')
             return None
 
-        if self.RE_CONCEPT_ID.match(sel):
+        if is_concept_id(sel):
             return sel
         else:
             text = self.te_graph.toPlainText()
@@ -600,6 +728,21 @@ class GraphAnnotator(QMainWindow):
 
         return None
 
+    def _concept_dialog(self, title: str, concept_name: str, attribute: bool) -> ConceptDialog:
+        # the dialog is built once and reset for each use
+        if self.concept_dialog is None:
+            self.concept_dialog = ConceptDialog(self, title, concept_name, attribute)
+        else:
+            self.concept_dialog.reset(title, concept_name, attribute)
+        return self.concept_dialog
+
+    def _relation_dialog(self, title: str, parent_id: str, child_id: str, label: str = '', update: bool = False) -> RelationDialog:
+        if self.relation_dialog is None:
+            self.relation_dialog = RelationDialog(self, title, parent_id, child_id, label, update)
+        else:
+            self.relation_dialog.reset(title, self.current_graph, parent_id, child_id, label, update)
+        return self.relation_dialog
+
     ####################  Menubar: Select  ####################
 
     def _menu_select_concept_in_graph(self, pctype):
@@ -628,7 +771,7 @@ class GraphAnnotator(QMainWindow):
             self.selected_concept = selection
             pc = 'Select concept'
 
-        self.statusbar.showMessage('{}: {}'.format(pc, cid))
+        self.statusbar.showMessage(f'{pc}: {cid}')
         self.refresh_annotation()
 
     def menu_select_parent(self):
@@ -717,6 +860,7 @@ class GraphAnnotator(QMainWindow):
             self.statusbar.showMessage('No text span is updated for {}'.format(concept_id))
             return None
 
+        self.dirty = True
         self.selected_text_spans.clear()
         self.refresh_text()
 
@@ -732,44 +876,44 @@ class GraphAnnotator(QMainWindow):
     ####################  Menubar: Navigate  ####################
 
     def menu_navigate_previous(self):
-        self.menu_file_save()
+        if self.dirty: self.menu_file_save()
         tid = self.tid - 1
 
         if 0 <= tid:
             self.select_annotation(tid)
-            self.statusbar.showMessage('Navigate: {}'.format(tid))
+            self.statusbar.showMessage(f'Navigate: {tid}')
         else:
             self.statusbar.showMessage('Already at the first text.')
 
     def menu_navigate_next(self):
-        self.menu_file_save()
+        if self.dirty: self.menu_file_save()
         tid = self.tid + 1
 
         if tid < len(self.graphs):
             self.select_annotation(tid)
-            self.statusbar.showMessage('Navigate: {}'.format(tid))
+            self.statusbar.showMessage(f'Navigate: {tid}')
         else:
             self.statusbar.showMessage('Already at the last text.')
 
     def menu_navigate_jump_first(self):
-        self.menu_file_save()
+        if self.dirty: self.menu_file_save()
         self.select_annotation(0)
-        self.statusbar.showMessage('Navigate: {}'.format(0))
+        self.statusbar.showMessage('Navigate: 0')
 
     def menu_navigate_jump_last(self):
-        self.menu_file_save()
+        if self.dirty: self.menu_file_save()
         tid = len(self.graphs) - 1
         self.select_annotation(tid)
-        self.statusbar.showMessage('Navigate: {}'.format(tid))
+        self.statusbar.showMessage(f'Navigate: {tid}')
 
     def menu_navigate_jump(self):
-        self.menu_file_save()
+        if self.dirty: self.menu_file_save()
         max = len(self.graphs) - 1
 
         tid, ok = QInputDialog.getInt(self, 'Jump to', 'Select between 0 and {}'.format(max), value=self.tid, min=0, max=max)
         if ok:
             self.select_annotation(tid)
-            self.statusbar.showMessage('Navigate: {}'.format(tid))
+            self.statusbar.showMessage(f'Navigate: {tid}')
 
     ########################################  Text & Graph  ########################################
 
@@ -780,90 +924,122 @@ class GraphAnnotator(QMainWindow):
             self.selected_child = None
             self.selected_concept = None
             self.selected_text_spans = set()
-            self.lb_tid.setText('{}:'.format(tid))
-            self.refresh_text()
-            self.refresh_graph()
+            self.refresh_timer.start()
+
+    def _refresh_selected_annotation(self):
+        self.lb_tid.setText(f'{self.tid}:')
+        self.refresh_annotation()
+
+    def flush_refresh(self):
+        # offsets and IDs are read from the views, so they must show the selected annotation first
+        if self.refresh_timer.isActive():
+            self.refresh_timer.stop()
+            self._refresh_selected_annotation()
 
     def refresh_annotation(self):
-        self.refresh_text()
-        self.refresh_graph()
+        # suspend painting so the text and graph views are redrawn once
+        self.setUpdatesEnabled(False)
+        try:
+            self.refresh_text()
+            self.refresh_graph()
+        finally:
+            self.setUpdatesEnabled(True)
 
     def refresh_text(self):
-        def color(token_id: int):
-            if token_id in selected_parent:
-                return self.COLOR_SELECTED_PARENT
-            if token_id in selected_child:
-                return self.COLOR_SELECTED_CHILD
-            if token_id in selected_concept:
-                return self.COLOR_SELECTED_CONCEPT
-            if token_id in self.selected_text_spans:
-                return self.COLOR_COVERED_TEXT_SPAN
-            if token_id in graph.covered_token_ids:
-                return self.COLOR_COVERED_TOKEN
-            return None
-
         graph = self.current_graph
-        selected_parent = set(graph.get_concept(self.selected_parent[0]).token_ids) if self.selected_parent else set()
-        selected_child = set(graph.get_concept(self.selected_child[0]).token_ids) if self.selected_child else set()
-        selected_concept = set(graph.get_concept(self.selected_concept[0]).token_ids) if self.selected_concept else set()
-        tt = []
 
-        for i, token in enumerate(graph.tokens):
-            c = color(i)
-            if c:
-                tt.append('<span style="background-color:{};">'.format(c))
-                tt.append(token)
-                tt.append('</span>')
-            else:
-                tt.append(token)
-            if i + 1 < len(graph.tokens):
-                tt.append(' ')
+        # token ID -> opening span; filled from the lowest to the highest priority so that later ones override
+        spans = dict.fromkeys(graph.covered_token_ids, self.SPAN_COVERED_TOKEN)
+        spans.update(dict.fromkeys(self.selected_text_spans, self.SPAN_COVERED_TEXT_SPAN))
+        if self.selected_concept:
+            spans.update(dict.fromkeys(graph.get_concept(self.selected_concept[0]).token_ids, self.SPAN_SELECTED_CONCEPT))
+        if self.selected_child:
+            spans.update(dict.fromkeys(graph.get_concept(self.selected_child[0]).token_ids, self.SPAN_SELECTED_CHILD))
+        if self.selected_parent:
+            spans.update(dict.fromkeys(graph.get_concept(self.selected_parent[0]).token_ids, self.SPAN_SELECTED_PARENT))
 
-        self.lb_text.setText(''.join(tt))
+        tokens = map(html.escape, graph.tokens)
+        tt = [f'{spans[i]}{token}</span>' if i in spans else token for i, token in enumerate(tokens)]
+        self.lb_text.setText(' '.join(tt))
 
     def refresh_graph(self):
-        def set_color(c, color):
+        def set_color(c, fmt: QTextCharFormat):
             if c is None: return
             cid, begin = c
             cursor.setPosition(begin, QTextCursor.MoveAnchor)
             cursor.movePosition(QTextCursor.Right, QTextCursor.KeepAnchor, len(cid))
-            cursor.insertHtml('<span style="background-color:{};">{}</span>'.format(color, cid))
+            cursor.mergeCharFormat(fmt)
+            self.graph_highlights.append((begin, len(cid)))
 
         def find_offset_in_graph(cid: str) -> int:
             c = graph.get_concept(cid)
-            s = '{} / {}'.format(cid, c.name)
+            s = f'{cid} / {c.name}'
             return text.find(s)
 
         cursor = self.te_graph.textCursor()
         cursor.setCharFormat(QTextCharFormat())
         cursor.clearSelection()
+        self.te_graph.setTextCursor(cursor)
+
+        # clear the previous highlights while their offsets are still valid
+        for begin, length in self.graph_highlights:
+            cursor.setPosition(begin, QTextCursor.MoveAnchor)
+            cursor.setPosition(begin + length, QTextCursor.KeepAnchor)
+            cursor.setCharFormat(QTextCharFormat())
+        self.graph_highlights.clear()
 
         graph = self.current_graph
-        text = '\n'.join(graph.penman_graphs())
-        self.te_graph.setText(text)
+        graphs = graph.penman_graphs()
+        text = '\n'.join(graphs)
+        self._update_graph_text(graphs)
         if self.selected_parent and self.selected_parent[1] is None:
             pid = self.selected_parent[0]
             self.selected_parent = pid, find_offset_in_graph(pid)
 
-        set_color(self.selected_parent, self.COLOR_SELECTED_PARENT)
-        set_color(self.selected_child, self.COLOR_SELECTED_CHILD)
-        set_color(self.selected_concept, self.COLOR_SELECTED_CONCEPT)
-        self.te_graph.setFont(self.FONT_GRAPH)
-        self.te_graph.repaint()
+        set_color(self.selected_parent, self.FORMAT_SELECTED_PARENT)
+        set_color(self.selected_child, self.FORMAT_SELECTED_CHILD)
+        set_color(self.selected_concept, self.FORMAT_SELECTED_CONCEPT)
+
+    def _update_graph_text(self, graphs: List[str]):
+        """
+        Replaces only the range of Penman graphs that differs from the ones currently displayed.
+        :param graphs: the list of graphs in the Penman notation to be displayed.
+        """
+        prev = self.graph_texts
+        if prev == graphs: return
+        prev_text, text = '\n'.join(prev), '\n'.join(graphs)
+
+        # number of graphs shared at the beginning and at the end
+        n = min(len(prev), len(graphs))
+        p = next((i for i in range(n) if prev[i] != graphs[i]), n)
+        s = next((i for i in range(n - p) if prev[-1 - i] != graphs[-1 - i]), n - p)
+
+        # number of characters shared at the beginning and at the end, including the separators
+        prefix = min(sum(len(g) + 1 for g in graphs[:p]), len(prev_text), len(text))
+        suffix = sum(len(g) + 1 for g in graphs[len(graphs) - s:])
+        suffix = min(suffix, len(prev_text) - prefix, len(text) - prefix)
+
+        cursor = QTextCursor(self.te_graph.document())
+        cursor.setPosition(prefix, QTextCursor.MoveAnchor)
+        cursor.setPosition(len(prev_text) - suffix, QTextCursor.KeepAnchor)
+        cursor.insertText(text[prefix:len(text) - suffix], QTextCharFormat())
+        self.graph_texts = graphs
 
     def selected_text_offset(self) -> Optional[Offset]:
         """
         :return: the offset if valid; otherwise, None.
         """
+        self.flush_refresh()
         text = self.lb_text.selectedText()
         begin = self.lb_text.selectionStart()
         end = begin + len(text)
         return Offset(begin, end) if text else None
 
     def selected_concept_in_graph(self) -> Optional[Tuple[str, int]]:
+        self.flush_refresh()
         cursor = self.te_graph.textCursor()
         cid = cursor.selectedText()
-        if self.RE_CONCEPT_ID.match(cid):
+        if is_concept_id(cid):
             begin = cursor.selectionStart()
             return cid, begin
         return None
@@ -878,11 +1054,63 @@ def message_box(text: str, icon: int, default_button: int = -1) -> int:
     return msg.exec_()
 
 
+def is_concept_id(s: str) -> bool:
+    # equivalent to RE_CONCEPT_ID.fullmatch(s) without running the regex engine
+    return len(s) > 1 and s[0] in 'ca' and s[1:].isdecimal()
+
+
+def background_format(color: str) -> QTextCharFormat:
+    fmt = QTextCharFormat()
+    fmt.setBackground(QColor(color))
+    return fmt
+
+
+def background_span(color: str) -> str:
+    return f'<span style="background-color:{color};">'
+
+
 def current_time():
     now = datetime.now()
     return now.strftime("%d/%m/%Y %H:%M:%S")
 
 
+def load_json(json_file: str) -> Dict:
+    """
+    Parsed resources are cached in the per-user cache directory and reused while the JSON file's size and mtime match.
+    :param json_file: the path to the JSON file.
+    :return: the object parsed from the JSON file.
+    """
+    # marshal cannot execute code on load, unlike pickle, and the cache is keyed by the absolute path
+    json_file = os.path.abspath(json_file)
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'streamside')
+    cache_file = os.path.join(cache_dir, hashlib.sha1(json_file.encode('utf-8')).hexdigest() + '.marshal')
+    st = os.stat(json_file)
+    key = (json_file, st.st_size, st.st_mtime_ns)
+
+    try:
+        with open(cache_file, 'rb') as fin:
+            cached_key, d = marshal.load(fin)
+        if tuple(cached_key) == key: return d
+    except Exception:
+        # the cache is disposable; e.g., a missing file or a marshal from another Python version, so reparse the JSON
+        pass
+
+    with open(json_file, 'rb') as fin:
+        d = json_loads(fin.read())
+
+    # the cache directory may not be writable, in which case the cache is skipped
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = '{}.{}'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as fout:
+            marshal.dump((key, d), fout)
+        os.replace(tmp_file, cache_file)
+    except (OSError, ValueError):
+        pass
+
+    return d
+
+
 def main():
     parser = argparse.ArgumentParser(description='StreamSide Annotator')
     parser.add_argument('-a', '--annotator', type=str, help='annotator ID')
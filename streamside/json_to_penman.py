@@ -16,16 +16,16 @@ __author__ = 'Jinho D. Choi'
 
 import argparse
 import glob
-import json
 import os
 
-from streamside.struct import Graph
+from streamside.struct import Graph, json_loads
 
 
 def convert(input_file: str, output_dir: str):
     output_file = os.path.join(output_dir, os.path.basename(input_file)[:-4] + 'penman')
-    fout = open(output_file, 'w')
-    d = json.load(open(input_file))
+    fout = open(output_file, 'w', encoding='utf-8')
+    with open(input_file, 'rb') as fin:
+        d = json_loads(fin.read())
 
     for g in d['graphs']:
         graph = Graph.factory(g)
@@ -23,7 +23,7 @@ from streamside import struct
 
 def convert(input_file: str, output_dir: str):
     output_file = os.path.join(output_dir, os.path.basename(input_file)[:-6] + 'json')
-    fout = open(output_file, 'w')
+    fout = open(output_file, 'w', encoding='utf-8')
     d = ['    ' + graph.json_dumps() for graph in struct.penman_reader(input_file)]
     fout.write('{{\n  "graphs": [\n{}\n  ]\n}}\n'.format(',\n'.join(d)))
 
@@ -17,7 +17,18 @@ __author__ = 'Jinho D. Choi'
 import copy
 import json
 import re
-from typing import Tuple, Optional, List, Dict, Set, Iterable
+import sys
+from typing import Tuple, Optional, List, Dict, Set, Iterable, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 PENMAN_TEXT = 'snt'
 PENMAN_TID = 'id'
@@ -25,6 +36,9 @@ PENMAN_ANNOTATOR = 'annotator'
 PENMAN_LAST_SAVED = 'save-date'
 PENMAN_ALIGNMENTS = 'align'
 
+RE_LRB = re.compile(r'\(\s+')
+RE_RRB = re.compile(r'\s+\)')
+
 
 class Concept:
     def __init__(self, name: str, token_ids: List[int] = None, attribute: bool = False):
@@ -161,12 +175,16 @@ class Graph:
         self._concept_id = 0
         self._relation_id = 0
 
+        # cache of penman_graphs(), cleared whenever the graph is modified
+        self._penman_graphs: Optional[List[str]] = None
+
     @property
     def root_ids(self) -> List[str]:
         """
         :return: list of root concept IDs sorted by begin offsets in ascending order.
         """
-        cids = [cid for cid in self.concepts if not self.parent_relations(cid, True)]
+        children = {r.child_id for r in self.relations.values() if not r.referent}
+        cids = [cid for cid in self.concepts if cid not in children]
         cids.sort(key=lambda x: int(x[1:]))
         return cids
 
@@ -195,10 +213,12 @@ class Graph:
         else:
             token_ids = []
 
-        # add concept
-        cid = '{}{}'.format('a' if attribute else 'c', self._concept_id)
+        # add concept; IDs are interned as they are compared against relations throughout
+        prefix = 'a' if attribute else 'c'
+        cid = sys.intern(f'{prefix}{self._concept_id}')
         self._concept_id += 1
         self.concepts[cid] = Concept(name, token_ids, attribute)
+        self._penman_graphs = None
         return cid
 
     def add_token_ids(self, concept_id: str, token_ids: Set[int]) -> Optional[Set[int]]:
@@ -211,6 +231,7 @@ class Graph:
         self.covered_token_ids.update(s)
         c.token_ids.extend(s)
         c.token_ids.sort()
+        self._penman_graphs = None
         return s
 
     def remove_token_ids(self, concept_id: str, token_ids: Set[int]) -> Optional[Set[int]]:
@@ -222,6 +243,7 @@ class Graph:
 
         self.covered_token_ids -= s
         c.token_ids = [t for t in c.token_ids if t not in s]
+        self._penman_graphs = None
         return s
 
     def update_concept(self, concept_id: str, name: str) -> Optional[Concept]:
@@ -233,6 +255,7 @@ class Graph:
         c = self.concepts.get(concept_id, None)
         if c is None: return None
         c.name = name
+        self._penman_graphs = None
         return c
 
     def remove_concept(self, concept_id: str, remove_relations: bool = True) -> Optional[Concept]:
@@ -251,6 +274,7 @@ class Graph:
 
         con = self.concepts.pop(concept_id)
         self.covered_token_ids -= set(con.token_ids)
+        self._penman_graphs = None
         return con
 
     def get_relation(self, relation_id: str) -> Optional[Relation]:
@@ -286,11 +310,12 @@ class Graph:
         :return: the ID of the added relation.
         """
         # generate ID
-        rid = 'r{}'.format(self._relation_id)
+        rid = f'r{self._relation_id}'
         self._relation_id += 1
 
         # add relation
         self.relations[rid] = Relation(parent_id, child_id, label, referent)
+        self._penman_graphs = None
         return rid
 
     def update_relation(self, relation_id: str, label: str) -> Optional[Relation]:
@@ -302,6 +327,7 @@ class Graph:
         r = self.relations.get(relation_id, None)
         if r is None: return None
         r.label = label
+        self._penman_graphs = None
         return r
 
     def remove_relation(self, relation_id: str) -> Optional[Relation]:
@@ -310,7 +336,9 @@ class Graph:
         :param relation_id: the ID of the relation to be removed.
         :return: the removed relation if exists; otherwise, None.
         """
-        return self.relations.pop(relation_id) if relation_id in self.relations else None
+        if relation_id not in self.relations: return None
+        self._penman_graphs = None
+        return self.relations.pop(relation_id)
 
     def get_child_ids(self, parent_id, ignore_referent: bool) -> Set[str]:
         """
@@ -381,7 +409,7 @@ class Graph:
             if rel.referent: return rel.child_id
             c = self.concepts[rel.child_id]
             if amr and c.attribute and self.parent_relations(rel.child_id): return c.name
-            return '({} / {}'.format(rel.child_id, c.name)
+            return f'({rel.child_id} / {c.name}'
 
         def aux(rel: Relation, r: List[str], indent: str):
             cname = repr_concept(rel)
@@ -389,12 +417,12 @@ class Graph:
             if not rel.referent:
                 indent += ' ' * (len(rel.child_id) + 2)
                 for rid, relation in sorted(self.child_relations(rel.child_id), key=lambda x: self.get_concept(x[1].child_id).first_token_id):
-                    r.append('\n{}:{} '.format(indent, relation.label))
+                    r.append(f'\n{indent}:{relation.label} ')
                     aux(relation, r, indent + ' ' * (len(relation.label) + 2))
                 if cname.startswith('('): r.append(')')
 
         def alignments():
-            ts = [(concept.token_ids[0], '{}/{}'.format(cid, ','.join(map(str, concept.token_ids)))) for cid, concept in self.concepts.items() if concept.token_ids]
+            ts = [(concept.token_ids[0], f'{cid}/{",".join(map(str, concept.token_ids))}') for cid, concept in self.concepts.items() if concept.token_ids]
             return ' '.join([v for k, v in sorted(ts)])
 
         rep = []
@@ -414,19 +442,24 @@ class Graph:
     def penman_graphs(self, amr: bool = False) -> List[str]:
         """
         :param amr: if True, the return notation is compatible to AMR.
-        :return: list of graphs in the Penman notation.
+        :return: list of graphs in the Penman notation; the non-AMR list is cached until the graph is modified.
         """
+        if not amr and self._penman_graphs is not None: return self._penman_graphs
         self._assign_first_token_ids()
-        return [self.penman(root_id, amr) for root_id in self.root_ids]
+        graphs = [self.penman(root_id, amr) for root_id in self.root_ids]
+        if not amr: self._penman_graphs = graphs
+        return graphs
 
     def json_dumps(self, **kwargs) -> str:
         """
         :return: the JSON representation of this AMR object.
         """
-        self.covered_token_ids = list(self.covered_token_ids)
-        s = json.dumps(self, default=lambda x: x.__dict__, **kwargs)
-        self.covered_token_ids = set(self.covered_token_ids)
-        return s
+        d = {k: v for k, v in self.__dict__.items() if k != '_penman_graphs'}
+        d['covered_token_ids'] = list(self.covered_token_ids)
+        # orjson writes compact UTF-8 JSON; the standard json module keeps its default spacing and escaping
+        if orjson and not kwargs:
+            return orjson.dumps(d, default=lambda x: x.__dict__).decode()
+        return json.dumps(d, default=lambda x: x.__dict__, **kwargs)
 
     def clone(self) -> 'Graph':
         """
@@ -465,6 +498,16 @@ class Graph:
         return [self.tokens[i] for i in token_ids]
 
 
+def json_loads(s: Union[str, bytes]):
+    """
+    :param s: the JSON document; bytes are preferred as they can be parsed without decoding.
+    :return: the object parsed by orjson or ujson if installed; otherwise, by the standard json module.
+    """
+    if orjson: return orjson.loads(s)
+    if ujson: return ujson.loads(s)
+    return json.loads(s)
+
+
 def penman_reader(input_file: str) -> Optional[List[Graph]]:
     class DynamicStack:
         def __init__(self):
@@ -591,10 +634,8 @@ def penman_reader(input_file: str) -> Optional[List[Graph]]:
 
         return g
 
-    RE_LRB = re.compile(r'\(\s+')
-    RE_RRB = re.compile(r'\s+\)')
     graph, comments, dstack = None, dict(), DynamicStack()
-    fin = open(input_file)
+    fin = open(input_file, encoding='utf-8')
     graphs = []
 
     for lid, line in enumerate(fin, 1):
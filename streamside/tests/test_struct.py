@@ -17,6 +17,7 @@ __author__ = 'Jinho D. Choi'
 import json
 import unittest
 
+from streamside import struct
 from streamside.struct import Graph, OffsetMap, Offset
 
 
@@ -98,12 +99,98 @@ class TestGraph(unittest.TestCase):
         self.assertEqual([('r1', self.amr.relations['r1'])], self.amr.parent_relations('c3'))
         self.assertEqual([('r4', self.amr.relations['r4'])], self.amr.parent_relations('c4'))
 
+    def test_root_ids_referent(self):
+        amr = Graph('The boy wants to go')
+        c0 = amr.add_concept('want-01', {2})
+        c1 = amr.add_concept('boy', {1})
+        c2 = amr.add_concept('go-02', {4})
+        amr.add_relation(c2, c1, 'ARG0', referent=True)
+        # a child of only referent relations stays a root
+        self.assertEqual([c0, c1, c2], amr.root_ids)
+
+        amr.add_relation(c0, c1, 'ARG0')
+        amr.add_relation(c0, c2, 'ARG1')
+        self.assertEqual([c0], amr.root_ids)
+
     def test_json(self):
         s = self.amr.json_dumps()
         d = json.loads(s)
         amr = Graph.factory(d)
         self.assertEqual(s, amr.json_dumps())
 
+    def test_json_backends(self):
+        amr = Graph('Rockström visited 東京')
+        c0 = amr.add_concept('visit-01', {1})
+        c1 = amr.add_concept('person', {0})
+        amr.add_relation(c0, c1, 'ARG0')
+        covered = set(amr.covered_token_ids)
+
+        orjson = struct.orjson
+        try:
+            struct.orjson = None
+            s = amr.json_dumps()
+            # the standard json module keeps its default format
+            self.assertEqual(json.dumps(json.loads(s)), s)
+            self.assertEqual(s, Graph.factory(json.loads(s)).json_dumps())
+        finally:
+            struct.orjson = orjson
+
+        s = amr.json_dumps()
+        self.assertEqual(s, Graph.factory(json.loads(s)).json_dumps())
+
+        amr.penman_graphs()
+        d = json.loads(amr.json_dumps())
+        self.assertNotIn('_penman_graphs', d)
+        self.assertEqual(sorted(covered), sorted(d['covered_token_ids']))
+        self.assertEqual(covered, amr.covered_token_ids)
+        self.assertIsInstance(amr.covered_token_ids, set)
+
+    def test_penman_cache(self):
+        amr = Graph('The boy wants to go')
+        c0 = amr.add_concept('want-01', {2})
+        c1 = amr.add_concept('boy', {1})
+        c2 = amr.add_concept('go-02', {4})
+        amr.add_relation(c0, c1, 'ARG0')
+        amr.add_relation(c0, c2, 'ARG1')
+        c3, rid = None, None
+
+        def add_concept():
+            nonlocal c3
+            c3 = amr.add_concept('person')
+
+        def add_relation():
+            nonlocal rid
+            rid = amr.add_relation(c0, c3, 'ARG2')
+
+        # every modification must invalidate the cached notation
+        for func in [add_concept,
+                     lambda: amr.add_token_ids(c2, {0}),
+                     lambda: amr.remove_token_ids(c2, {0}),
+                     lambda: amr.update_concept(c1, 'girl'),
+                     add_relation,
+                     lambda: amr.update_relation(rid, 'ARG3'),
+                     lambda: amr.remove_relation(rid),
+                     lambda: amr.remove_concept(c3)]:
+            s = amr.penman_graphs()
+            func()
+            self.assertNotEqual(s, amr.penman_graphs())
+
+        # the AMR notation is never served from the cache
+        s = amr.penman_graphs()
+        a = amr.penman_graphs(amr=True)
+        self.assertTrue(all(g.startswith('# ::') for g in a))
+        self.assertEqual(s, amr.penman_graphs())
+        self.assertEqual(a, amr.penman_graphs(amr=True))
+
+        # a clone does not share the cache with the original
+        clone = amr.clone()
+        clone.update_concept(c1, 'boy')
+        self.assertNotEqual(s, clone.penman_graphs())
+        self.assertEqual(s, amr.penman_graphs())
+        amr.update_concept(c0, 'need-01')
+        self.assertNotEqual(amr.penman_graphs(), clone.penman_graphs())
+        self.assertIn('want-01', clone.penman_graphs()[0])
+
     def test_remove_concept(self):
         amr = self.amr.clone()
         self.assertEqual(['c1'], amr.root_ids)